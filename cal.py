@@ -29,14 +29,20 @@ from astropy.coordinates import AltAz, EarthLocation, SkyCoord
 from astropy.io import fits 
 from astropy.stats import sigma_clipped_stats
 from astropy.time import Time
+from astropy.wcs import WCS
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from photutils import make_source_mask
 from reproject import reproject_interp
+from reproject.mosaicking import find_optimal_celestial_wcs
+from scipy import ndimage
 
 class Pipeline:
 
-	def __init__(self):
+	def __init__(self, binning=1):
 
 		self.__name = "cal_pipeline"
+		self.__binning = int(binning)
+		self.__dark_library = {}
 
 	def __str__(self):
 
@@ -46,8 +52,12 @@ class Pipeline:
 
 		return self.__name
 
+	def get_binning(self):
+
+		return self.__binning
+
 	def align_objects(self, object_list, output_dir, method):
-		"""Align a series of frames to a reference frame via ASTROALIGN or WCS REPROJECTION"""
+		"""Align a series of frames to a reference frame via ASTROALIGN, WCS REPROJECTION or FFT PHASE CORRELATION"""
 
 		if len(object_list) == 0 or len(object_list) == 1:
 
@@ -79,12 +89,40 @@ class Pipeline:
 					target_data = target_frame[0].data
 					target_header = target_frame[0].header
 
-					if method == "astroalign":
+					frame_method = method
+
+					if method == "phase":
+
+						print("Estimating translation via FFT PHASE CORRELATION")
+						shift = self.phase_correlate(target_data, reference_data)
+
+						if self.detect_rotation(target_data, reference_data, shift):
+
+							if "CTYPE1" in target_header and "CTYPE1" in reference_header:
+								frame_method = "reproject"
+
+							else:
+								frame_method = "astroalign"
+
+							print("Rotation detected, falling back to", frame_method.upper())
+
+					if frame_method == "phase":
+
+						print("Shifting target frame by", shift, "px")
+						array = ndimage.shift(target_data.astype(float), shift, order=1, mode="constant", cval=np.nan)
+
+						print("Updating target WCS reference pixel")
+						target_header = target_header.copy()
+						if "CRPIX1" in target_header and "CRPIX2" in target_header:
+							target_header["CRPIX1"] += shift[1]
+							target_header["CRPIX2"] += shift[0]
+
+					elif frame_method == "astroalign":
 
 						print("Aligning target frame with reference frame via ASTROALIGN")
 						array = aa.register(target_data, reference_data)
 
-					elif method == "reproject":
+					elif frame_method == "reproject":
 
 						print("Converting target data to FITS")
 						target_hdu = fits.PrimaryHDU(target_data, header=target_header)
@@ -100,9 +138,168 @@ class Pipeline:
 
 		return
 
+	def bin_frame(self, data, header=None):
+		"""Bin a frame N x N by block averaging and adjust its WCS and binning keywords for the quick-look mode"""
+
+		binning = self.__binning
+
+		ny, nx = data.shape
+		data = np.asarray(data[:ny - ny % binning, :nx - nx % binning], dtype=float)
+		binned_data = data.reshape(ny // binning, binning, nx // binning, binning).mean(axis=(1, 3))
+
+		if header != None:
+
+			header = header.copy()
+			header["BINNING"] = header.get("BINNING", 1) * binning
+
+			for key in ["XBINNING", "YBINNING", "XPIXSZ", "YPIXSZ", "CDELT1", "CDELT2", "CD1_1", "CD1_2", "CD2_1", "CD2_2"]:
+				if key in header:
+					header[key] *= binning
+
+			for key in ["CRPIX1", "CRPIX2"]:
+				if key in header:
+					header[key] = (header[key] - 0.5) / binning + 0.5
+
+			# Averaging N x N pixels divides the noise per ADU by N, raising the effective gain by N^2
+			if "GAIN" in header:
+				header["GAIN"] *= binning**2
+
+		return binned_data, header
+
+	def coadd_mosaic(self, object_list, output_path, method="mean", tile_size=2048, max_workers=4):
+		"""Coadd a series of plate-solved frames onto a common sky grid tile by tile via WCS REPROJECTION"""
+
+		print("Reading frame headers")
+		frame_list = []
+
+		for obj in object_list:
+			header = fits.getheader(obj)
+			frame_list.append(((header["NAXIS2"], header["NAXIS1"]), WCS(header)))
+
+		print("Computing optimal output WCS from frame footprints")
+		output_wcs, output_shape = find_optimal_celestial_wcs(frame_list)
+		output_header = output_wcs.to_header()
+
+		print("Locating frame footprints on output grid")
+		footprint_list = []
+
+		for frame_shape, frame_wcs in frame_list:
+
+			corners = frame_wcs.calc_footprint(axes=(frame_shape[1], frame_shape[0]))
+			x, y = output_wcs.all_world2pix(corners[:, 0], corners[:, 1], 0)
+			footprint_list.append((np.floor(np.min(x)), np.ceil(np.max(x)), np.floor(np.min(y)), np.ceil(np.max(y))))
+
+		# Allocate the mosaic on disk so no full-size array is ever held in memory, under a
+		# temporary name so an interrupted run never leaves a partial mosaic at output_path
+		part_path = output_path + ".part"
+
+		print("Allocating", output_shape, "mosaic", part_path)
+		mosaic_header = fits.PrimaryHDU(np.zeros((1, 1), dtype=np.float32)).header
+		mosaic_header["NAXIS1"] = output_shape[1]
+		mosaic_header["NAXIS2"] = output_shape[0]
+		mosaic_header.update(output_header)
+		mosaic_header.tofile(part_path, overwrite=True)
+
+		data_size = output_shape[0] * output_shape[1] * 4
+		with open(part_path, "rb+") as mosaic_file:
+			mosaic_file.seek(len(mosaic_header.tostring()) + math.ceil(data_size / 2880) * 2880 - 1)
+			mosaic_file.write(b"\0")
+
+		mosaic = fits.open(part_path, mode="update", memmap=True)
+
+		with ProcessPoolExecutor(max_workers=max_workers) as executor:
+
+			futures = {}
+
+			for y0 in range(0, output_shape[0], tile_size):
+
+				for x0 in range(0, output_shape[1], tile_size):
+
+					y1 = min(y0 + tile_size, output_shape[0])
+					x1 = min(x0 + tile_size, output_shape[1])
+					tile_bounds = (y0, y1, x0, x1)
+
+					overlap_list = []
+
+					for obj, (frame_x0, frame_x1, frame_y0, frame_y1) in zip(object_list, footprint_list):
+
+						if frame_x1 >= x0 and frame_x0 < x1 and frame_y1 >= y0 and frame_y0 < y1:
+							overlap_list.append(obj)
+
+					if len(overlap_list) == 0:
+						mosaic[0].data[y0:y1, x0:x1] = np.nan
+
+					else:
+						print("Queueing tile", tile_bounds, "with", len(overlap_list), "frames")
+						futures[executor.submit(self.coadd_tile, overlap_list, output_header, tile_bounds, method)] = tile_bounds
+
+			for future in as_completed(futures):
+
+				y0, y1, x0, x1 = futures.pop(future)
+
+				print("Writing tile", (y0, y1, x0, x1), "to mosaic")
+				mosaic[0].data[y0:y1, x0:x1] = future.result()
+
+		mosaic.close()
+
+		print("Writing mosaic to", output_path)
+		os.replace(part_path, output_path)
+
+		return
+
+	def coadd_tile(self, object_list, output_header, tile_bounds, method="mean"):
+		"""Reproject and combine the frames overlapping a single mosaic tile, one frame cutout at a time"""
+
+		y0, y1, x0, x1 = tile_bounds
+		tile_shape = (y1 - y0, x1 - x0)
+		tile_wcs = WCS(output_header)[y0:y1, x0:x1]
+		tile_corners = tile_wcs.calc_footprint(axes=(tile_shape[1], tile_shape[0]))
+
+		tile_sum = np.zeros(tile_shape)
+		tile_footprint = np.zeros(tile_shape)
+
+		for obj in object_list:
+
+			# Only the part of the frame under the tile (plus an interpolation margin) is read from disk
+			with fits.open(obj, memmap=True) as frame:
+
+				frame_wcs = WCS(frame[0].header)
+				frame_ny, frame_nx = frame[0].shape
+
+				x, y = frame_wcs.all_world2pix(tile_corners[:, 0], tile_corners[:, 1], 0)
+				frame_x0 = max(int(np.floor(np.min(x))) - 2, 0)
+				frame_x1 = min(int(np.ceil(np.max(x))) + 3, frame_nx)
+				frame_y0 = max(int(np.floor(np.min(y))) - 2, 0)
+				frame_y1 = min(int(np.ceil(np.max(y))) + 3, frame_ny)
+
+				if frame_x0 >= frame_x1 or frame_y0 >= frame_y1:
+					continue
+
+				cutout_data = np.array(frame[0].data[frame_y0:frame_y1, frame_x0:frame_x1], dtype=float)
+				cutout_wcs = frame_wcs[frame_y0:frame_y1, frame_x0:frame_x1]
+
+			array, footprint = reproject_interp((cutout_data, cutout_wcs), tile_wcs, shape_out=tile_shape)
+
+			tile_sum += np.nan_to_num(array) * footprint
+			tile_footprint += footprint
+
+		if method == "sum":
+			tile_data = tile_sum
+
+		else:
+			with np.errstate(invalid="ignore", divide="ignore"):
+				tile_data = tile_sum / tile_footprint
+
+		# Uncovered sky is NaN throughout the mosaic, not 0
+		tile_data[tile_footprint == 0] = np.nan
+
+		return tile_data.astype(np.float32)
+
 	def combine_darks(self, dark_list, method="median"):
 		"""Combine a series of dark frames into a master dark via CCDPROC"""
 
+		dark_list = self.load_frames(dark_list)
+
 		if method == "median":
 			print("Combining darks by median")
 			master_dark = ccdproc.combine(dark_list, method="median", unit="adu", mem_limit=6e9)
@@ -117,9 +314,204 @@ class Pipeline:
 
 		return master_dark
 
+	def build_dark_library(self, dark_list, library_dir, method="median"):
+		"""Build a persistent library of master darks and bias/dark-current models indexed by exposure, temperature and date"""
+
+		print("Indexing dark frames")
+		dark_groups = {}
+
+		for dark in dark_list:
+
+			dark_header = fits.getheader(dark)
+			dark_exposure = float(dark_header["exposure"])
+			dark_temperature = dark_header.get("CCD-TEMP")
+			dark_date = str(dark_header.get("DATE-OBS", "unknown"))[:10]
+
+			if dark_temperature != None:
+				dark_temperature = round(float(dark_temperature))
+
+			dark_groups.setdefault((dark_date, dark_temperature, dark_exposure), []).append(dark)
+
+		if not os.path.isdir(library_dir):
+			os.makedirs(library_dir)
+
+		# Quick-look darks are binned at load and kept apart from full-resolution ones
+		binning_suffix = ""
+		if self.__binning > 1:
+			binning_suffix = "-bin" + str(self.__binning)
+
+		# Master dark per (date, temperature, exposure)
+		model_groups = {}
+		rebuilt_groups = set()
+
+		for (dark_date, dark_temperature, dark_exposure), group_list in sorted(dark_groups.items(), key=str):
+
+			master_path = library_dir + "/master-dark-" + dark_date + "-" + str(dark_temperature) + "C-" + ("%g" % dark_exposure) + "s" + binning_suffix + ".fit"
+			model_groups.setdefault((dark_date, dark_temperature), []).append((dark_exposure, master_path))
+
+			# A master is only current if it was combined from exactly the raw darks now in its group
+			input_names = sorted(os.path.basename(dark) for dark in group_list)
+
+			combined_names = None
+			if os.path.isfile(master_path):
+				combined_header = fits.getheader(master_path)
+				combined_names = sorted(combined_header.get("IMCMB%03d" % i, "") for i in range(1, combined_header.get("NCOMBINE", 0) + 1))
+
+			if combined_names == input_names:
+				print("Skipping pre-existing library dark", master_path)
+
+			else:
+				master_dark = self.combine_darks(group_list, method=method)
+
+				master_dark.header["exposure"] = dark_exposure
+				master_dark.header["DATE-OBS"] = dark_date
+				master_dark.header["IMAGETYP"] = "MASTER DARK"
+				master_dark.header["NCOMBINE"] = len(group_list)
+				for i, name in enumerate(input_names, start=1):
+					master_dark.header["IMCMB%03d" % i] = name
+				master_dark.header["BINNING"] = self.__binning
+				if dark_temperature != None:
+					master_dark.header["CCD-TEMP"] = dark_temperature
+
+				print("Writing library dark", master_path)
+				ccdproc.fits_ccddata_writer(master_dark, master_path, overwrite=True)
+				rebuilt_groups.add((dark_date, dark_temperature))
+
+		# Bias plus dark-current model per (date, temperature)
+		for (dark_date, dark_temperature), master_list in sorted(model_groups.items(), key=str):
+
+			model_path = library_dir + "/dark-model-" + dark_date + "-" + str(dark_temperature) + "C" + binning_suffix + ".fit"
+			model_exposures = sorted(exposure for exposure, master_path in master_list)
+
+			# A model is only current if it was fit to every exposure setting now in the library and none of its masters changed
+			fitted_exposures = None
+			if os.path.isfile(model_path):
+				fitted_header = fits.getheader(model_path)
+				fitted_exposures = sorted(fitted_header["EXPOS" + str(i)] for i in range(1, fitted_header.get("NEXPOSE", 0) + 1))
+
+			if len(master_list) < 2:
+				print("Insufficient exposure settings for dark model on", dark_date, "at", dark_temperature, "C")
+
+			elif fitted_exposures == model_exposures and (dark_date, dark_temperature) not in rebuilt_groups:
+				print("Skipping pre-existing dark model", model_path)
+
+			else:
+				print("Fitting bias and dark current to", len(master_list), "exposure settings")
+				exposure_array = np.array([exposure for exposure, master_path in master_list])
+				master_array = np.array([fits.getdata(master_path).astype(float) for exposure, master_path in master_list])
+
+				exposure_offset = exposure_array - np.mean(exposure_array)
+				master_offset = master_array - np.mean(master_array, axis=0)
+
+				current_data = np.tensordot(exposure_offset, master_offset, axes=1) / np.sum(exposure_offset**2)
+				bias_data = np.mean(master_array, axis=0) - current_data * np.mean(exposure_array)
+
+				model_header = fits.Header()
+				model_header["DATE-OBS"] = dark_date
+				model_header["IMAGETYP"] = "DARK MODEL"
+				model_header["BINNING"] = self.__binning
+				model_header["NEXPOSE"] = len(model_exposures)
+				for i, exposure in enumerate(model_exposures, start=1):
+					model_header["EXPOS" + str(i)] = exposure
+				if dark_temperature != None:
+					model_header["CCD-TEMP"] = dark_temperature
+
+				bias_hdu = fits.PrimaryHDU(bias_data, header=model_header)
+				current_hdu = fits.ImageHDU(current_data, name="CURRENT")
+
+				print("Writing dark model", model_path)
+				fits.HDUList([bias_hdu, current_hdu]).writeto(model_path, overwrite=True)
+
+		# Force get_master_dark to re-index the updated library
+		self.__dark_library.pop(library_dir, None)
+
+		return
+
+	def get_master_dark(self, library_dir, exposure, temperature=None, date=None):
+		"""Serve the nearest master dark from the dark library, synthesized from the dark model or scaled when no exposure match exists"""
+
+		def distance(header):
+
+			temperature_distance = 0
+			date_distance = 0
+
+			if temperature != None and header.get("CCD-TEMP") != None:
+				temperature_distance = abs(float(header["CCD-TEMP"]) - float(temperature))
+
+			# Unknown-temperature entries only win when nothing matches the requested temperature
+			elif temperature != None:
+				temperature_distance = float("inf")
+
+			if date != None and header.get("DATE-OBS", "unknown") != "unknown":
+				date_distance = abs(Time(str(header["DATE-OBS"])[:10]).jd - Time(str(date)[:10]).jd)
+
+			return (temperature_distance, date_distance)
+
+		# Library headers are read once per library and reused on every request
+		if library_dir not in self.__dark_library:
+
+			print("Indexing dark library", library_dir)
+			master_list = []
+			model_list = []
+
+			for item in glob.glob(library_dir + "/master-dark-*.fit"):
+				header = fits.getheader(item)
+				if header.get("BINNING", 1) == self.__binning:
+					master_list.append((item, header))
+
+			for item in glob.glob(library_dir + "/dark-model-*.fit"):
+				header = fits.getheader(item)
+				if header.get("BINNING", 1) == self.__binning:
+					model_list.append((item, header))
+
+			self.__dark_library[library_dir] = (master_list, model_list)
+
+		master_list, model_list = self.__dark_library[library_dir]
+
+		if len(master_list) == 0:
+			raise FileNotFoundError("No master darks in library " + library_dir)
+
+		exposure = float(exposure)
+		matched_list = [(item, header) for item, header in master_list if abs(float(header["exposure"]) - exposure) < 1e-3]
+
+		best_master = min(matched_list, key=lambda entry: distance(entry[1]), default=None)
+		best_model = min(model_list, key=lambda entry: distance(entry[1]), default=None)
+
+		if best_master != None and (best_model == None or distance(best_master[1]) <= distance(best_model[1])):
+
+			print("Reading library dark", best_master[0])
+			master_dark = ccdproc.fits_ccddata_reader(best_master[0], unit="adu")
+
+		elif best_model != None:
+
+			print("Synthesizing", exposure, "s dark from model", best_model[0])
+			bias_data = fits.getdata(best_model[0], 0)
+			current_data = fits.getdata(best_model[0], "CURRENT")
+			master_dark_data = bias_data + current_data * exposure
+
+			master_dark = ccdproc.CCDData(master_dark_data, unit="adu", meta=best_model[1].copy())
+			master_dark.header["IMAGETYP"] = "MASTER DARK"
+			master_dark.header["exposure"] = exposure
+
+		else:
+
+			best_master = min(master_list, key=lambda entry: distance(entry[1]) + (abs(float(entry[1]["exposure"]) - exposure),))
+
+			# Without a dark model at this binning there is no bias estimate to hold back from the scaling
+			print("WARNING: no dark model in library, scaling library dark", best_master[0], "to", exposure, "s including its bias level")
+			master_dark = ccdproc.fits_ccddata_reader(best_master[0], unit="adu")
+			master_dark_data = np.asarray(master_dark) * exposure / float(master_dark.header["exposure"])
+
+			master_dark = ccdproc.CCDData(master_dark_data, unit="adu", meta=master_dark.header)
+			master_dark.header["exposure"] = exposure
+
+		return master_dark
+
 	def combine_flats(self, flat_list, master_dark, method="median"):
 		"""Combine and reduce a series of flat frames into a normalized flatfield via CCDPROC"""
 
+		flat_list = self.load_frames(flat_list)
+
 		if method == "median":
 			print("Combining flats by median")
 			combined_flat = ccdproc.combine(flat_list, method="median", unit="adu", mem_limit=6e9)
@@ -167,6 +559,87 @@ class Pipeline:
 
 		return stack
 
+	def detect_rotation(self, target_data, reference_data, shift, tolerance=1.0):
+		"""Check whether rotation or scale between the frames would misalign the frame corners by more than tolerance px after a pure shift"""
+
+		ny, nx = reference_data.shape
+		region_size = min(256, ny // 2, nx // 2)
+
+		quadrant_centers = [(ny // 4, nx // 4), (ny // 4, 3 * nx // 4), (3 * ny // 4, nx // 4), (3 * ny // 4, 3 * nx // 4)]
+
+		rotation_sum = 0.0
+		scale_sum = 0.0
+		radius_sum = 0.0
+
+		for center in quadrant_centers:
+
+			quadrant_shift = self.phase_correlate(target_data, reference_data, center=center, region_size=region_size)
+
+			# Under a small rotation (scale) the shift residual grows perpendicular (parallel) to the offset from the frame center
+			offset_y = center[0] - ny // 2
+			offset_x = center[1] - nx // 2
+			residual_y = quadrant_shift[0] - shift[0]
+			residual_x = quadrant_shift[1] - shift[1]
+
+			rotation_sum += offset_x * residual_y - offset_y * residual_x
+			scale_sum += offset_y * residual_y + offset_x * residual_x
+			radius_sum += offset_y**2 + offset_x**2
+
+		angle = rotation_sum / radius_sum
+		scale_error = scale_sum / radius_sum
+
+		print("Estimated rotation", "%.4f" % math.degrees(angle), "deg, scale error", "%.2e" % scale_error)
+
+		return np.hypot(angle, scale_error) * np.hypot(ny / 2, nx / 2) > tolerance
+
+	def phase_correlate(self, target_data, reference_data, center=None, region_size=512, upsample_factor=100):
+		"""Estimate the (y, x) shift that aligns a target frame with a reference frame via FFT PHASE CORRELATION"""
+
+		ny, nx = reference_data.shape
+
+		if center == None:
+			center = (ny // 2, nx // 2)
+
+		y0 = min(max(center[0] - region_size // 2, 0), max(ny - region_size, 0))
+		x0 = min(max(center[1] - region_size // 2, 0), max(nx - region_size, 0))
+
+		reference_region = np.asarray(reference_data[y0:y0 + region_size, x0:x0 + region_size], dtype=float)
+		target_region = np.asarray(target_data[y0:y0 + region_size, x0:x0 + region_size], dtype=float)
+
+		reference_region = np.nan_to_num(reference_region - np.nanmedian(reference_region))
+		target_region = np.nan_to_num(target_region - np.nanmedian(target_region))
+
+		# Taper region edges to suppress FFT wrap-around artifacts
+		height, width = reference_region.shape
+		window = np.outer(np.hanning(height), np.hanning(width))
+
+		cross_power = np.fft.fft2(reference_region * window) * np.conj(np.fft.fft2(target_region * window))
+		cross_power /= np.abs(cross_power) + 1e-12
+		correlation = np.fft.ifft2(cross_power).real
+
+		peak_y, peak_x = np.unravel_index(np.argmax(correlation), correlation.shape)
+
+		if peak_y > height / 2:
+			peak_y -= height
+
+		if peak_x > width / 2:
+			peak_x -= width
+
+		# Sub-pixel refinement by upsampled DFT of the cross-power spectrum around the integer peak (Guizar-Sicairos et al. 2008)
+		upsampled_size = math.ceil(1.5 * upsample_factor)
+		upsampled_center = upsampled_size // 2
+
+		row_kernel = np.exp(2j * np.pi * np.outer(np.arange(upsampled_size) - upsampled_center + peak_y * upsample_factor, np.fft.fftfreq(height, upsample_factor)))
+		column_kernel = np.exp(2j * np.pi * np.outer(np.fft.fftfreq(width, upsample_factor), np.arange(upsampled_size) - upsampled_center + peak_x * upsample_factor))
+		upsampled_correlation = np.abs(row_kernel @ cross_power @ column_kernel)
+
+		upsampled_y, upsampled_x = np.unravel_index(np.argmax(upsampled_correlation), upsampled_correlation.shape)
+
+		dy = peak_y + (upsampled_y - upsampled_center) / upsample_factor
+		dx = peak_x + (upsampled_x - upsampled_center) / upsample_factor
+
+		return dy, dx
+
 	def extract_sources(self, object_frame):
 
 		object_name = object_frame[:-4]
@@ -201,7 +674,7 @@ class Pipeline:
 
 		# Extraction
 		detect_type = ["DETECT_TYPE", "CCD"] # CCD (linear) or PHOTO (with gamma correction)
-		detect_minarea = ["DETECT_MINAREA", "3"] # min. # of pixels above threshold
+		detect_minarea = ["DETECT_MINAREA", str(max(1, 3 // self.__binning**2))] # min. # of pixels above threshold
 		detect_thresh = ["DETECT_THRESH", "5.0"] # <sigmas> or <threshold>,<ZP> in mag.arcsec-2
 		analysis_thresh = ["ANALYSIS_THRESH", "5.0"] # <sigmas> or <threshold>,<ZP> in mag.arcsec-2
 		detection_filter = ["FILTER", "Y"] # apply filter for detection (Y or N)?
@@ -220,7 +693,7 @@ class Pipeline:
 		flag_type = ["FLAG_TYPE", "OR"] # flag pixel combination: OR, AND, MIN, MAX or MOST
 
 		# Photometry
-		phot_apertures = ["PHOT_APERTURES", "20"] # MAG_APER aperture diameter(s) in pixels
+		phot_apertures = ["PHOT_APERTURES", "%g" % (20 / self.__binning)] # MAG_APER aperture diameter(s) in pixels
 		phot_autoparams = ["PHOT_AUTOPARAMS", "2.5", "3.5"] # MAG_AUTO parameters: <Kron_fact>,<min_radius>
 		phot_petroparams = ["PHOT_PETROPARAMS", "2.0", "3.5"] # MAG_PETRO parameters: <Petrosian_fact>,<min_radius>
 		phot_autoapers = ["PHOT_AUTOAPERS", "0.0", "0.0"] # <estimation>,<measurement> minimum apertures for MAG_AUTO and MAG_PETRO
@@ -228,7 +701,7 @@ class Pipeline:
 		satur_key = ["SATUR_KEY", "SATURATE"] # keyword for saturation level (in ADUs)
 		mag_zeropoint = ["MAG_ZEROPOINT", "0.0"] # magnitude zero-point
 		mag_gamma = ["MAG_GAMMA", "4.0"] # gamma of emulsion (for photographic scans)
-		gain = ["GAIN", "1.39"]	# keyword for detector gain in e-/ADU
+		gain = ["GAIN", "%g" % (1.39 * self.__binning**2)]	# keyword for detector gain in e-/ADU
 		gain_key = ["GAIN_KEY", "GAIN"]	# keyword for detector gain in e-/ADU
 		pixel_scale = ["PIXEL_SCALE", "0"] # size of pixel in arcsec (0=use FITS WCS info)
 
@@ -239,7 +712,7 @@ class Pipeline:
 		# Background
 		back_type = ["BACK_TYPE", "AUTO"] # AUTO or MANUAL
 		back_value = ["BACK_VALUE", "0.0"] # Default background value in MANUAL mode
-		back_size = ["BACK_SIZE", "64"]	# Background mesh: <size> or <width>,<height>
+		back_size = ["BACK_SIZE", str(64 // self.__binning)]	# Background mesh: <size> or <width>,<height>
 		back_filtersize = ["BACK_FILTERSIZE", "3"] # Background filter: <size> or <width>,<height>
 
 		# Check Image
@@ -362,6 +835,23 @@ class Pipeline:
 
 		return mean_seeing, mean_growth_radius
 
+	def load_frames(self, frame_list):
+		"""Read a series of frames into CCDData binned for the quick-look mode"""
+
+		if self.__binning == 1:
+			return frame_list
+
+		binned_list = []
+
+		for frame in frame_list:
+
+			print("Binning", frame, str(self.__binning) + "x" + str(self.__binning))
+			ccd = ccdproc.fits_ccddata_reader(frame, unit="adu")
+			binned_data, binned_header = self.bin_frame(ccd.data, ccd.header)
+			binned_list.append(ccdproc.CCDData(binned_data, unit="adu", meta=binned_header))
+
+		return binned_list
+
 	def plate_solve(self, object_frame, search=None):
 
 		print("Defining astrometry file names")
@@ -406,11 +896,21 @@ class Pipeline:
 		obj_frame_data = obj_frame[0].data
 		obj_frame_header = obj_frame[0].header
 
+		if self.__binning > 1:
+			print("Binning object frame", str(self.__binning) + "x" + str(self.__binning))
+			obj_frame_data, obj_frame_header = self.bin_frame(obj_frame_data, obj_frame_header)
+
 		# Subtract master dark
-		print("Opening master dark frame")
-		master_dark = fits.open(master_dark)
-		master_dark_data = master_dark[0].data
-		master_dark_header = master_dark[0].header
+		if isinstance(master_dark, str):
+			print("Opening master dark frame")
+			master_dark = fits.open(master_dark)
+			master_dark_data = master_dark[0].data
+			master_dark_header = master_dark[0].header
+
+		else:
+			print("Reading master dark data")
+			master_dark_data = np.asarray(master_dark)
+			master_dark_header = master_dark.header
 
 		print("Subtracting master dark from object")
 		reduced_obj_frame_data = obj_frame_data - master_dark_data
@@ -435,14 +935,15 @@ class Pipeline:
 		if bkg_method == "mesh":
 
 			nsigma = 2.0
-			npixels = 5
-			dilate_size = 31
+			npixels = max(2, 5 // self.__binning**2)
+			dilate_size = (31 // self.__binning) | 1
+			mesh_size = 64 // self.__binning
 
 			print("Creating mask")
 			mask = make_source_mask(reduced_obj_frame_data, nsigma=nsigma, npixels=npixels, dilate_size=dilate_size)
 
 			print("Subtracting background mesh")
-			background = sep.Background(reduced_obj_frame_data, mask=mask)
+			background = sep.Background(reduced_obj_frame_data, mask=mask, bw=mesh_size, bh=mesh_size)
 			reduced_obj_frame_data -= background
 
 		elif bkg_method == "sigma":
@@ -467,70 +968,57 @@ if __name__ == "__main__":
 	config.read("config.ini")
 
 	print("Initializing pipeline")
-	pipeline = Pipeline()
+	binning = config["Test"].getint("binning", fallback=1)
+	pipeline = Pipeline(binning=binning)
 
-	# --- Combine flat darks
-	dark_flat_dir = config["Test"]["dark_flat_dir"]
-	dark_flat_path = dark_flat_dir + "/master-dark.fit"
-
-	if os.path.isfile(dark_flat_path):
-		print("Reading pre-existing master (flat) dark")
-		master_dark_flat = fits.open(dark_flat_path)
+	if binning > 1:
+		print("Running quick-look mode at", str(binning) + "x" + str(binning), "binning")
+		binning_suffix = "-bin" + str(binning)
 
 	else:
-		os.chdir(dark_flat_dir)
-		dark_flat_list = []
-
-		for item in glob.glob("*.fit"):
-			print("Adding", item, "to dark (flat) list")
-			dark_flat_list.append(item)
-
-		master_dark_flat = pipeline.combine_darks(dark_flat_list, method="median")
-
-		print("Writing master (flat) dark to output")
-		ccdproc.fits_ccddata_writer(master_dark_flat, dark_flat_path, overwrite=True)
-
-	# --- Combine object darks
-	dark_obj_dir = config["Test"]["dark_obj_dir"]
-	dark_obj_path = dark_obj_dir + "/master-dark.fit"
+		binning_suffix = ""
 
-	if os.path.isfile(dark_obj_path):
+	# --- Build dark library
+	dark_library_dir = config["Test"]["dark_library_dir"]
+	dark_list = []
 
-		print("Reading pre-existing master (object) dark")
-		master_dark_obj = fits.open(dark_obj_path)
+	for dark_dir in [config["Test"]["dark_flat_dir"], config["Test"]["dark_obj_dir"]]:
 
-	else:
-
-		os.chdir(dark_obj_dir)
-		dark_obj_list = []
+		for item in glob.glob(dark_dir + "/*.fit"):
 
-		for item in glob.glob("*.fit"):
-			print("Adding", item, "to dark (object) list")
-			dark_obj_list.append(item)
+			if "master" in os.path.basename(item):
+				print("Not adding", item, "to dark library")
 
-		master_dark_obj = pipeline.combine_darks(dark_obj_list)
+			else:
+				print("Adding", item, "to dark library")
+				dark_list.append(item)
 
-		print("Writing master (object) dark to output")
-		ccdproc.fits_ccddata_writer(master_dark_obj, dark_obj_path, overwrite=True)
+	pipeline.build_dark_library(dark_list, dark_library_dir, method="median")
 
 	# --- Combine flats
 	flat_dir = config["Test"]["flat_dir"]
-	flat_path = flat_dir + "/flatfield.fit"
+	flat_path = flat_dir + "/flatfield" + binning_suffix + ".fit"
 
 	if os.path.isfile(flat_path):
 		print("Reading pre-existing flatfield")
 		flatfield = fits.open(flat_path)
 
 	else:
-		print("Opening master dark (flat) frame")
-		master_dark = ccdproc.fits_ccddata_reader(dark_flat_path)
-
 		os.chdir(flat_dir)
 		flat_list = []
 
 		for item in glob.glob("*.fit"):
-			print("Adding", item, "to flat list")
-			flat_list.append(item)
+
+			if "flatfield" in item:
+				print("Not adding", item, "to flat list")
+
+			else:
+				print("Adding", item, "to flat list")
+				flat_list.append(item)
+
+		print("Requesting master dark (flat) from dark library")
+		flat_header = fits.getheader(flat_list[0])
+		master_dark = pipeline.get_master_dark(dark_library_dir, flat_header["exposure"], temperature=flat_header.get("CCD-TEMP"), date=flat_header.get("DATE-OBS"))
 
 		flatfield = pipeline.combine_flats(flat_list, master_dark, method="median")
 
@@ -557,24 +1045,41 @@ if __name__ == "__main__":
 		elif "stack" in item:
 			print("Not adding", item, "to reduction queue")
 
+		elif "mosaic" in item:
+			print("Not adding", item, "to reduction queue")
+
 		else:
 			print("Adding", item, "to reduction queue")
 			obj_list.append(item)
 
 	obj_list = sorted(obj_list)
 
+	# Quick-look products are kept apart from full-resolution ones
+	output_dir = obj_dir
+
+	if binning > 1:
+		output_dir = obj_dir + "/bin" + str(binning)
+
+	if not os.path.isdir(output_dir):
+		os.makedirs(output_dir)
+
 	for obj in obj_list:
 
-		if os.path.isfile("reduced-" + obj):
+		if os.path.isfile(output_dir + "/reduced-" + obj):
 			print("Skipping reduction on", obj)
 
 		else:
-			reduced_frame = pipeline.reduce_object(obj, flat_path, dark_obj_path, bkg_method="mesh")
+			print("Requesting master dark (object) from dark library")
+			obj_header = fits.getheader(obj)
+			master_dark_obj = pipeline.get_master_dark(dark_library_dir, obj_header["exposure"], temperature=obj_header.get("CCD-TEMP"), date=obj_header.get("DATE-OBS"))
+
+			reduced_frame = pipeline.reduce_object(obj, flat_path, master_dark_obj, bkg_method="mesh")
 
 			print("Writing", obj, "to output")
-			reduced_frame.writeto(obj_dir + "/reduced-" + obj, overwrite=True)
+			reduced_frame.writeto(output_dir + "/reduced-" + obj, overwrite=True)
 
 	# --- Plate solve objects
+	os.chdir(output_dir)
 	plate_solve_list = []
 
 	for item in glob.glob("reduced*.fit"):
@@ -600,27 +1105,45 @@ if __name__ == "__main__":
 
 	align_list = sorted(align_list)
 
-	pipeline.align_objects(align_list, obj_dir, method="reproject")
+	mosaic = config["Test"].getboolean("mosaic", fallback=False)
 
-	# --- Stack aligned objects
-	stack_list = []
+	if mosaic:
 
-	for item in glob.glob("a-wcs-reduced-*.fit"):
-		print("Adding", item, "to stack queue")
-		stack_list.append(item)
+		# --- Mosaic coadd plate-solved objects
+		stack_list = align_list
+		stack_path = "mosaic.fit"
 
-	stack_list = sorted(stack_list)
+		if os.path.isfile(stack_path):
+			print("Skipping pre-existing mosaic")
 
-	if os.path.isfile("stack.fit"):
-		print("Reading pre-existing stack")
-		stack = ccdproc.fits_ccddata_reader("stack.fit")
+		else:
+			pipeline.coadd_mosaic(align_list, output_dir + "/" + stack_path, method="mean")
 
 	else:
-		stack = pipeline.combine_stack(stack_list)
-		print("Writing stack to output directory")
-		ccdproc.fits_ccddata_writer(stack, obj_dir + "/stack.fit", overwrite=True)
 
-	mean_seeing, mean_growth_radius = pipeline.extract_sources("stack.fit")
+		pipeline.align_objects(align_list, output_dir, method="reproject")
+
+		# --- Stack aligned objects
+		stack_list = []
+
+		for item in glob.glob("a-wcs-reduced-*.fit"):
+			print("Adding", item, "to stack queue")
+			stack_list.append(item)
+
+		stack_list = sorted(stack_list)
+
+		if os.path.isfile("stack.fit"):
+			print("Reading pre-existing stack")
+			stack = ccdproc.fits_ccddata_reader("stack.fit")
+
+		else:
+			stack = pipeline.combine_stack(stack_list)
+			print("Writing stack to output directory")
+			ccdproc.fits_ccddata_writer(stack, output_dir + "/stack.fit", overwrite=True)
+
+		stack_path = "stack.fit"
+
+	mean_seeing, mean_growth_radius = pipeline.extract_sources(stack_path)
 
 	print("Mean seeing:", mean_seeing, "arcsec")
 	print("Mean growth radius:", mean_growth_radius, "px")
@@ -28,7 +28,8 @@ setup(
 		"ccdproc >= 2.1.0", 
 		"numpy >= 1.18.5", 
 		"photutils >= 0.7.2",
-		"reproject >= 0.7.1",
+		"reproject >= 0.8",
+		"scipy >= 1.4.1",
 		"sep >= 1.0.3"]
 )
 